@@ -43,12 +43,16 @@
 # FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
 # OTHER DEALINGS IN THE SOFTWARE.
 
+import array
 import io
 import struct
-import itertools
 import os
-import re
+import shutil
+import sys
+import threading
 from collections import namedtuple as T
+from concurrent.futures import ThreadPoolExecutor
+from functools import cached_property
 from collections.abc import Callable
 
 from .utf import UTFTable, R
@@ -71,13 +75,33 @@ wave_type_ftable = {
     WAVEFORM_ENCODE_TYPE_NINTENDO_DSP : ".dsp"
 }
 # fmt: on
+# wave_type_ftable as a list indexed by EncodeType, which is a 1-byte column.
+# Unknown types fall back to the number itself.
+wave_type_exts = [wave_type_ftable.get(i, str(i)) for i in range(256)]
+
+
+def _wave_type_ext(enc_type):
+    if 0 <= enc_type < 256:
+        return wave_type_exts[enc_type]
+    return str(enc_type)
+
+
 track_t = T(
     "track_t",
     ("cue_id", "name", "enc_type", "is_stream"),
 )
+# SynthTable ReferenceItems: (item type, waveform index)
+reference_item_t = struct.Struct(">HH")
 
 
 class TrackList(object):
+    """The tracks in an ACB file, stored as parallel lists: cue_ids, names,
+    enc_types and is_streams. Indexing or iterating the list gives track_t
+    objects; slicing gives a list of them. .tracks is a list of all of them,
+    built on first access and then kept; changes made to it are not reflected
+    in the columns.
+    """
+
     def __init__(self, utf):
         cue_handle = io.BytesIO(utf.rows[0]["CueTable"])
         nam_handle = io.BytesIO(utf.rows[0]["CueNameTable"])
@@ -92,12 +116,27 @@ class TrackList(object):
         wavs = UTFTable(wav_handle, encoding=utf.encoding)
         syns = UTFTable(syn_handle, encoding=utf.encoding)
 
-        self.tracks: list[track_t] = []
+        self.cue_ids: list[int] = []
+        self.names: list[str] = []
+        self.enc_types: list[int] = []
+        self.is_streams: list[int] = []
 
-        name_map = {}
+        # CueIndex is small and dense, so names are looked up by list index.
+        name_map = ["UNKNOWN"] * (
+            max((row["CueIndex"] for row in nams.rows), default=-1) + 1
+        )
         for row in nams.rows:
             name_map[row["CueIndex"]] = row["CueName"]
 
+        # Pull the waveform columns we need out of the row dicts up front.
+        wav_ids = [
+            w["MemoryAwbId"] if w.get("Id") is None else w["Id"] for w in wavs.rows
+        ]
+        extern_wav_ids = [w["StreamAwbId"] for w in wavs.rows]
+        enc_types = [w["EncodeType"] for w in wavs.rows]
+        streamings = [w["Streaming"] for w in wavs.rows]
+
+        unpack_ref = reference_item_t.unpack
         wav_idx = 0
         for row in cues.rows:
             if row["ReferenceType"] not in {3, 8}:
@@ -105,45 +144,73 @@ class TrackList(object):
                     f"ReferenceType {row["ReferenceType"]} not implemented."
                 )
 
-            for i in range(row["NumRelatedWaveforms"]):
+            ref_idx = row["ReferenceIndex"]
+            base_name = name_map[ref_idx] if ref_idx < len(name_map) else "UNKNOWN"
+            num_wavs = row["NumRelatedWaveforms"]
+            # Cues with several waveforms get a numbered track for each.
+            if num_wavs == 1:
+                self.names.append(base_name)
+            else:
+                self.names.extend(f"{base_name}_{i + 1:02}" for i in range(num_wavs))
+
+            for _ in range(num_wavs):
                 r_data = syns.rows[wav_idx]["ReferenceItems"]
                 wav_idx += 1
-                _, b = struct.unpack(">HH", r_data)
-                wav_id = wavs.rows[b].get("Id")
-                if wav_id is None:
-                    wav_id = wavs.rows[b]["MemoryAwbId"]
-                extern_wav_id = wavs.rows[b]["StreamAwbId"]
-                enc = wavs.rows[b]["EncodeType"]
-                is_stream = wavs.rows[b]["Streaming"]
-
-                self.tracks.append(
-                    track_t(
-                        extern_wav_id if is_stream else wav_id,
-                        name_map.get(row["ReferenceIndex"], "UNKNOWN")
-                        + ("" if row["NumRelatedWaveforms"] == 1 else f"_{i+1:02}"),
-                        enc,
-                        is_stream,
-                    )
-                )
+                _, b = unpack_ref(r_data)
+                is_stream = streamings[b]
+
+                self.cue_ids.append(extern_wav_ids[b] if is_stream else wav_ids[b])
+                self.enc_types.append(enc_types[b])
+                self.is_streams.append(is_stream)
 
-        if len(wavs.rows) > len(self.tracks):
+        if len(wavs.rows) > len(self):
             raise ValueError(
-                f"Missed wavs. Has {cues} and {wavs}, but made {len(self.tracks)} tracks"
+                f"Missed wavs. Has {cues} and {wavs}, but made {len(self)} tracks"
             )
 
+    def __len__(self):
+        return len(self.cue_ids)
+
+    def __getitem__(self, i) -> track_t | list[track_t]:
+        if isinstance(i, slice):
+            return list(
+                map(
+                    track_t._make,
+                    zip(
+                        self.cue_ids[i],
+                        self.names[i],
+                        self.enc_types[i],
+                        self.is_streams[i],
+                    ),
+                )
+            )
+        return track_t(
+            self.cue_ids[i], self.names[i], self.enc_types[i], self.is_streams[i]
+        )
 
-def align(n):
-    def _align(number):
-        return (number + n - 1) & ~(n - 1)
+    def __iter__(self):
+        return map(
+            track_t._make,
+            zip(self.cue_ids, self.names, self.enc_types, self.is_streams),
+        )
 
-    return _align
+    @cached_property
+    def tracks(self) -> list[track_t]:
+        return list(self)
 
 
 afs2_file_ent_t = T("afs2_file_ent_t", ("cue_id", "offset", "size"))
+# Largest single read/write used when copying a file out of an AWB.
+COPY_CHUNK_SIZE = 1 << 20
 
 
 class AFSArchive(object):
-    def __init__(self, file: io.BufferedIOBase, *, encoding: str | None = None):
+    def __init__(
+        self,
+        file: io.BufferedIOBase | bytes | memoryview,
+        *,
+        encoding: str | None = None,
+    ):
         # Note: we don't do anything involving strings here so encoding is not actually required
         buf = R(file, encoding=encoding or "utf-8")
 
@@ -165,17 +232,20 @@ class AFSArchive(object):
         # print("afs2: aligned to", self.alignment, "bytes")
 
         self.offset_size: int = version[1]
-        self.offset_mask: int = int("FF" * self.offset_size, 16)
+        self.offset_mask: int = (1 << (self.offset_size * 8)) - 1
         cue_id_size = version[2]
         # print("afs2: a file offset is", self.offset_size, "bytes")
 
         self.files: list[afs2_file_ent_t] = []
+        self.files_by_cue_id: dict[int, afs2_file_ent_t] = {}
         self.create_file_entries(
             buf, file_count, cue_id_size, self.offset_size, self.offset_mask
         )
         self.src = buf
+        # Reads seek the shared file object, so they must not interleave.
+        self.src_lock = threading.Lock()
 
-    def _struct_format(self, size):
+    def _array_typecode(self, size):
         if size == 2:
             return "H"
         elif size == 4:
@@ -186,42 +256,98 @@ class AFSArchive(object):
         self, buf, file_count, cue_id_size, offset_size, offset_mask
     ):
         buf.seek(0x10)
-        read_cue_ids = struct.Struct(
-            "<" + (self._struct_format(cue_id_size) * file_count)
-        )
-        read_raw_offs = struct.Struct(
-            "<" + (self._struct_format(offset_size) * (file_count + 1))
-        )
-        # read all in one go
-        cue_ids = buf.struct(read_cue_ids)
-        raw_offs = buf.struct(read_raw_offs)
+        # read all in one go, letting array do the unpacking in C
+        cue_ids = array.array(self._array_typecode(cue_id_size))
+        cue_ids.frombytes(buf.bytes(cue_id_size * file_count))
+        raw_offs = array.array(self._array_typecode(offset_size))
+        raw_offs.frombytes(buf.bytes(offset_size * (file_count + 1)))
+        # the tables are little endian
+        if sys.byteorder == "big":
+            cue_ids.byteswap()
+            raw_offs.byteswap()
         # apply the mask
-        unaligned_offs = tuple(map(lambda x: x & offset_mask, raw_offs))
-        aligned_offs = tuple(map(align(self.alignment), unaligned_offs))
-        offsets_for_length_calculating = unaligned_offs[1:]
-        lengths = itertools.starmap(
-            lambda my_offset, next_offset: next_offset - my_offset,
-            zip(aligned_offs, offsets_for_length_calculating),
-        )
+        unaligned_offs = [x & offset_mask for x in raw_offs]
+        # round each offset up to the alignment
+        pad = self.alignment - 1
+        align_mask = ~pad
+        aligned_offs = [(x + pad) & align_mask for x in unaligned_offs]
+        # each file runs up to the (unaligned) start of the next one
+        lengths = [u - a for a, u in zip(aligned_offs, unaligned_offs[1:])]
 
         self.files = list(
-            itertools.starmap(afs2_file_ent_t, zip(cue_ids, aligned_offs, lengths))
+            map(afs2_file_ent_t._make, zip(cue_ids.tolist(), aligned_offs, lengths))
         )
+        # Reversed so that the first entry wins if a cue ID is duplicated.
+        self.files_by_cue_id = {f.cue_id: f for f in reversed(self.files)}
+
+    def _file_for_cue_id(self, cue_id):
+        f = self.files_by_cue_id.get(cue_id)
+        if f is None:
+            raise ValueError(f"id {cue_id} not found in archive")
+        return f
+
+    def file_data_for_cue_id(self, cue_id, rw=False, out=None):
+        """Reads the data for cue_id. If rw is True, a bytearray is returned.
+
+        Otherwise, the result is read-only. If the archive was created from a
+        file object, it is bytes. If it was created from a bytes-like object
+        (as embedded AWBs are), it is a memoryview into that buffer instead,
+        to avoid a copy. Note that memoryview has no bytes methods such as
+        .startswith() or .decode() and can't be concatenated with +; call
+        bytes() on it if you need them.
+
+        If out is a writable buffer at least as large as the file, the data is
+        read into it and a memoryview over the filled part is returned;
+        otherwise out is ignored.
+        """
+        f = self._file_for_cue_id(cue_id)
+        with self.src_lock:
+            if out is not None and len(out) >= f.size:
+                view = memoryview(out)[: f.size]
+                n = self.src.bytesinto(view, at=f.offset)
+                # out may hold an earlier file; pad a truncated read with
+                # zeros, as a fresh bytearray would be
+                if n < f.size:
+                    view[n:] = bytes(f.size - n)
+                return view
+            elif rw:
+                buf = bytearray(f.size)
+                self.src.bytesinto(buf, at=f.offset)
+                return buf
+            else:
+                return self.src.view(f.size, f.offset)
 
-    def file_data_for_cue_id(self, cue_id, rw=False):
-        for f in self.files:
-            if f.cue_id == cue_id:
-                if rw:
-                    buf = bytearray(f.size)
-                    self.src.bytesinto(buf, at=f.offset)
-                    return buf
-                else:
-                    return self.src.bytes(f.size, at=f.offset)
-        raise ValueError(f"id {cue_id} not found in archive")
+    def copy_file_to(self, cue_id, out, chunk=COPY_CHUNK_SIZE):
+        """Writes the data for cue_id to the file object out, reading at most
+        chunk bytes at a time so the whole file never has to be in memory.
+        If the archive is truncated, the missing tail is written as zeros,
+        the same as file_data_for_cue_id(rw=True) returns.
+        """
+        f = self._file_for_cue_id(cue_id)
+        if self.src.in_memory:
+            data = self.src.view(f.size, f.offset)
+            out.write(data)
+            done = len(data)
+        else:
+            view = memoryview(bytearray(min(chunk, f.size)))
+            done = 0
+            while done < f.size:
+                with self.src_lock:
+                    n = self.src.bytesinto(
+                        view[: min(len(view), f.size - done)], at=f.offset + done
+                    )
+                if not n:
+                    break
+                out.write(view[:n])
+                done += n
+
+        while done < f.size:
+            n = min(chunk, f.size - done)
+            out.write(bytes(n))
+            done += n
 
 
 AnyFile = str | os.PathLike | io.BufferedIOBase
-Uninitialized = object()
 
 
 def _get_file_obj(name: AnyFile) -> tuple[io.BufferedIOBase, bool]:
@@ -267,21 +393,23 @@ class ACBFile(object):
         else:
             self.awb_handle, self.awb_handle_owned = _get_file_obj(extern_awb)
 
-        self.encoding = encoding or "sjis"
+        # Strings are decoded separately from parsing, so falling back to
+        # UTF-8 doesn't have to read the table (and embedded AWB) again.
+        utf = UTFTable(self.acb_handle, encoding=None)
         try:
-            utf = UTFTable(self.acb_handle, encoding=encoding or "sjis")
+            utf.decode(encoding or "sjis")
             self.track_list = TrackList(utf)
         except UnicodeDecodeError:
             if encoding is None:
-                self.encoding = "utf-8"
-                utf = UTFTable(self.acb_handle, encoding="utf-8")
+                utf.decode("utf-8")
                 self.track_list = TrackList(utf)
             else:
                 raise
+        self.encoding = utf.encoding
 
         if len(utf.rows[0]["AwbFile"]) > 0:
             self.embedded_awb = AFSArchive(
-                io.BytesIO(utf.rows[0]["AwbFile"]), encoding=self.encoding
+                utf.rows[0]["AwbFile"], encoding=self.encoding
             )
         else:
             self.embedded_awb = None  # type: ignore
@@ -292,35 +420,34 @@ class ACBFile(object):
             self.external_awb = None  # type: ignore
 
         self.hca_keys = hca_keys
-        self.embedded_disarm: DisarmContext | None = Uninitialized  # type: ignore
-        self.external_disarm: DisarmContext | None = Uninitialized  # type: ignore
 
         self.closed = False
 
-    def get_embedded_disarm(self) -> DisarmContext | None:
-        if self.embedded_disarm is Uninitialized:
-            if self.hca_keys and self.embedded_awb:
-                self.embedded_disarm = DisarmContext(
-                    self.hca_keys, self.embedded_awb.mix_key
-                )
-            else:
-                self.embedded_disarm = None
+    @cached_property
+    def embedded_disarm(self) -> DisarmContext | None:
+        if self.hca_keys and self.embedded_awb:
+            return DisarmContext(self.hca_keys, self.embedded_awb.mix_key)
+        return None
+
+    @cached_property
+    def external_disarm(self) -> DisarmContext | None:
+        if self.hca_keys and self.external_awb:
+            return DisarmContext(self.hca_keys, self.external_awb.mix_key)
+        return None
 
+    def get_embedded_disarm(self) -> DisarmContext | None:
         return self.embedded_disarm
 
     def get_external_disarm(self) -> DisarmContext | None:
-        if self.external_disarm is Uninitialized:
-            if self.hca_keys and self.external_awb:
-                self.external_disarm = DisarmContext(
-                    self.hca_keys, self.external_awb.mix_key
-                )
-            else:
-                self.external_disarm = None
         return self.external_disarm
 
     def get_track_data(
-        self, track: track_t, disarm: bool | None = None, unmask: bool = True
-    ) -> bytearray:
+        self,
+        track: track_t,
+        disarm: bool | None = None,
+        unmask: bool = True,
+        out: bytearray | None = None,
+    ) -> bytearray | memoryview:
         """Gets encoded audio data as a bytearray.
 
         Arguments:
@@ -333,7 +460,44 @@ class ACBFile(object):
         - unmask: Whether to remove XOR masking from HCA header tags.
             This only has an effect if decryption is enabled, whether implicitly or
             explicitly.
+        - out: Optional scratch buffer to read the track into. If it's large
+            enough to hold the track, a memoryview into it is returned instead
+            of a new bytearray. The view is only valid until out is reused.
         """
+        awb, disarmer = self._source_for_track(track, disarm)
+        buf = awb.file_data_for_cue_id(track.cue_id, rw=True, out=out)
+        if disarmer:
+            disarmer.disarm(buf, not unmask)
+
+        return buf
+
+    def get_track_data_into(
+        self,
+        track: track_t,
+        fileobj: io.RawIOBase | io.BufferedIOBase,
+        disarm: bool | None = None,
+        unmask: bool = True,
+        out: bytearray | None = None,
+    ):
+        """Writes encoded audio data to fileobj. Unless the track has to be
+        decrypted, it is copied in chunks rather than read into memory whole.
+
+        Arguments are the same as for get_track_data(). out is only used if the
+        track is decrypted.
+        """
+        awb, disarmer = self._source_for_track(track, disarm)
+        if disarmer:
+            buf = awb.file_data_for_cue_id(track.cue_id, rw=True, out=out)
+            disarmer.disarm(buf, not unmask)
+            fileobj.write(buf)
+        else:
+            awb.copy_file_to(track.cue_id, fileobj)
+
+    def _source_for_track(
+        self, track: track_t, disarm: bool | None
+    ) -> tuple[AFSArchive, DisarmContext | None]:
+        """Returns the archive holding track, and the DisarmContext to decrypt it
+        with, or None if it should be left alone."""
         if self.closed:
             raise ValueError("ACBFile is closed")
 
@@ -343,16 +507,16 @@ class ACBFile(object):
                     f"Track {track} is streamed, but there's no external AWB attached."
                 )
 
-            buf = self.external_awb.file_data_for_cue_id(track.cue_id, rw=True)
-            disarmer = self.get_external_disarm()
+            awb = self.external_awb
+            disarmer = self.external_disarm
         else:
             if not self.embedded_awb:
                 raise ValueError(
                     f"Track {track} is internal, but this ACB file has no internal AWB."
                 )
 
-            buf = self.embedded_awb.file_data_for_cue_id(track.cue_id, rw=True)
-            disarmer = self.get_embedded_disarm()
+            awb = self.embedded_awb
+            disarmer = self.embedded_disarm
 
         if disarm is True and not disarmer:
             raise ValueError(
@@ -364,10 +528,7 @@ class ACBFile(object):
         if disarm is None:
             disarm = disarmer is not None
 
-        if disarm and disarmer:
-            disarmer.disarm(buf, not unmask)
-
-        return buf
+        return awb, disarmer if disarm else None
 
     def __enter__(self):
         return self
@@ -395,14 +556,51 @@ class ACBFile(object):
 
 
 def find_awb(path):
-    if re.search(r"\.acb$", path):
-        awb_path = re.sub(r"\.acb$", ".awb", path)
+    if path.endswith(".acb"):
+        awb_path = path[:-4] + ".awb"
         if os.path.exists(awb_path):
             return awb_path
 
 
 def name_gen_default(track):
-    return f"{track.name}{wave_type_ftable.get(track.enc_type, track.enc_type)}"
+    return f"{track.name}{_wave_type_ext(track.enc_type)}"
+
+
+def _output_jobs(target_dir, names, wav_keys):
+    """Splits writing the named outputs into jobs that can run in parallel.
+    Returns a list of jobs, each a list of track indices in track order.
+
+    If several tracks map to the same path, only the last one is written, as
+    if they were written one after another. Tracks that share a waveform go
+    in the same job so it is only read once, and so do paths that differ only
+    in case (BGM.hca and bgm.hca), which may or may not be the same file
+    depending on the filesystem. Writing those in order keeps the last one
+    winning either way.
+    """
+    last_for_path = {}
+    for i, name in enumerate(names):
+        path = os.path.normcase(os.path.abspath(os.path.join(target_dir, name)))
+        last_for_path[path] = i
+    # dict order is the order each path was first seen, not the last
+    kept = sorted(last_for_path.items(), key=lambda item: item[1])
+
+    parent = list(range(len(names)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    first_for_key = {}
+    for path, i in kept:
+        for key in (("wav", wav_keys[i]), ("path", path.casefold())):
+            parent[find(i)] = find(first_for_key.setdefault(key, i))
+
+    jobs = {}
+    for _, i in kept:
+        jobs.setdefault(find(i), []).append(i)
+    return list(jobs.values())
 
 
 def extract_acb(
@@ -413,6 +611,7 @@ def extract_acb(
     name_gen: Callable[[track_t], str] = name_gen_default,
     no_unmask: bool = False,
     encoding: str | None = None,
+    max_workers: int | None = None,
 ):
     """Oneshot file extraction API. Dumps all tracks from a file into the
     named output directory.
@@ -430,6 +629,9 @@ def extract_acb(
         i.e. True will result in unmasking being disabled.
     - encoding: Encoding used for track names. See ACBFile's docstring
         for behaviour when this argument is None/omitted.
+    - max_workers: Number of threads used to write tracks out. Defaults to
+        1 if hca_keys is given, since decryption can't run in parallel, and
+        to up to 4 otherwise. Pass 1 to extract tracks one at a time.
     """
     if isinstance(acb_file, str) and extern_awb is None:
         extern_awb = find_awb(acb_file)
@@ -437,8 +639,73 @@ def extract_acb(
     with ACBFile(
         acb_file, extern_awb=extern_awb, hca_keys=hca_keys, encoding=encoding
     ) as acb:
-        for track in acb.track_list.tracks:
-            name = name_gen(track)
+        if max_workers is None:
+            max_workers = 1 if hca_keys else min(4, os.cpu_count() or 1)
+
+        # Tracks that don't need decrypting are streamed straight to disk.
+        # The rest are read whole, so each worker reuses one buffer for them.
+        # With several workers it is capped, so that memory doesn't grow with
+        # workers x largest track; bigger tracks get a buffer of their own.
+        scratch_size = 0
+        if hca_keys:
+            awbs = [awb for awb in (acb.embedded_awb, acb.external_awb) if awb]
+            scratch_size = max((f.size for awb in awbs for f in awb.files), default=0)
+            if max_workers > 1:
+                scratch_size = min(scratch_size, COPY_CHUNK_SIZE)
+        local = threading.local()
+
+        def dump_track(track, path):
+            if scratch_size and not hasattr(local, "scratch"):
+                local.scratch = bytearray(scratch_size)
+
+            # Tracks are written in a single call or in COPY_CHUNK_SIZE pieces,
+            # both of which the default BufferedWriter hands straight to the OS.
+            # A larger buffer would only add a copy for tracks smaller than it.
+            with open(path, "wb") as out_file:
+                acb.get_track_data_into(
+                    track,
+                    out_file,
+                    unmask=not no_unmask,
+                    out=getattr(local, "scratch", None),
+                )
+
+        def dump_job(indices):
+            # Path already holding each waveform, to copy it from. A write may
+            # replace any path that only differs from it in case, so those
+            # stop being used as sources.
+            written = {}
+            for i in indices:
+                path = os.path.join(target_dir, names[i])
+                folded = os.path.normcase(os.path.abspath(path)).casefold()
+                src = written.get(wav_keys[i])
+                if src is None:
+                    dump_track(track_list[i], path)
+                else:
+                    try:
+                        shutil.copyfile(src[0], path)
+                    except shutil.SameFileError:
+                        # same file on a case-insensitive filesystem
+                        pass
+                written = {k: v for k, v in written.items() if v[1] != folded}
+                written[wav_keys[i]] = (path, folded)
+
+        # Names are generated up front so name_gen is called in track order.
+        # The default one only needs two of the columns, so no track_t is
+        # built for it.
+        track_list = acb.track_list
+        if name_gen is name_gen_default:
+            names = [
+                f"{name}{_wave_type_ext(enc_type)}"
+                for name, enc_type in zip(track_list.names, track_list.enc_types)
+            ]
+        else:
+            names = [name_gen(track) for track in track_list]
+
+        # Several cues can share a waveform. Read (and decrypt) it once, then
+        # copy the result to the other names. Tracks are grouped by index, and
+        # only the ones that are read are made into a track_t.
+        wav_keys = list(zip(track_list.is_streams, track_list.cue_ids))
+        jobs = _output_jobs(target_dir, names, wav_keys)
 
-            with open(os.path.join(target_dir, name), "wb") as out_file:
-                out_file.write(acb.get_track_data(track, unmask=not no_unmask))
+        with ThreadPoolExecutor(max_workers=max_workers) as ex:
+            list(ex.map(dump_job, jobs))
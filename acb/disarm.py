@@ -1,5 +1,5 @@
 import struct
-from typing import Optional
+from typing import Optional, Union
 
 try:
     import _acb_speedup
@@ -184,9 +184,10 @@ class DisarmContext(object):
 
         return key_table_2
 
-    def disarm(self, buf: bytearray, no_unmask: bool=False):
+    def disarm(self, buf: Union[bytearray, memoryview], no_unmask: bool=False):
         """
-        Remove encryption from a full HCA file in buf.
+        Remove encryption from a full HCA file in buf. buf can be a bytearray
+        or a writable memoryview.
         - no_unmask: If true, this will leave section names alone, which means
           files will not be decodable by ffmpeg.
         """
@@ -198,21 +199,23 @@ class DisarmContext(object):
             self.unmask_header(buf, header_size)
             masked = False
 
+        # memoryview has no index(), so search a copy of the header instead
+        header = bytes(buf[:header_size])
         try:
-            comp_seg = buf.index(b"\xe3\xef\xed\xf0" if masked else b"comp", 0, header_size)
+            comp_seg = header.index(b"\xe3\xef\xed\xf0" if masked else b"comp", 0, header_size)
         except ValueError:
             try:
-                comp_seg = buf.index(b"\xe4\xe5\xe3\x00" if masked else b"dec\x00", 0, header_size)
+                comp_seg = header.index(b"\xe4\xe5\xe3\x00" if masked else b"dec\x00", 0, header_size)
             except ValueError:
                 raise ValueError("cannot find a segment containing the block size")
 
         try:
-            ciph_seg = buf.index(b"\xe3\xe9\xf0\xe8" if masked else b"ciph", 0, header_size)
+            ciph_seg = header.index(b"\xe3\xe9\xf0\xe8" if masked else b"ciph", 0, header_size)
         except ValueError:
             return
 
         try:
-            fmt_seg = buf.index(b"\xe6\xed\xf4\x00" if masked else b"fmt\x00", 0, header_size)
+            fmt_seg = header.index(b"\xe6\xed\xf4\x00" if masked else b"fmt\x00", 0, header_size)
         except ValueError:
             raise ValueError("cannot find the fmt segment")
 
@@ -275,16 +278,16 @@ class DisarmContext(object):
         Do not call this method. If you were already using this, update your code to 
         use disarm_blocks().
         """
-        base = frompos
         stop = frompos + (blocksize * blockcnt)
-        while base < stop:
-            if _acb_speedup:
-                _acb_speedup.disarm_block_fast(memoryview(buf)[base:base + blocksize], usetable)
-            else:
-                for i in range(base, base + blocksize - 2):
-                    buf[i] = usetable[buf[i]]
-
-                end = base + blocksize - 2
-                buf[end:end + 2] = checksum(memoryview(buf)[base:end]).to_bytes(2, "big")
+        view = memoryview(buf)
+        if _acb_speedup:
+            for base in range(frompos, stop, blocksize):
+                _acb_speedup.disarm_block_fast(view[base:base + blocksize], usetable)
+            return
 
-            base += blocksize
+        # Substitute every block in one pass. This also scrambles the checksums,
+        # but they are all recomputed below.
+        view[frompos:stop] = view[frompos:stop].tobytes().translate(usetable)
+        for base in range(frompos, stop, blocksize):
+            end = base + blocksize - 2
+            view[end:end + 2] = checksum(view[base:end]).to_bytes(2, "big")
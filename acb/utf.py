@@ -70,12 +70,48 @@ def readfunc(fmt):
 def latebinder(f):
     return lambda s: f(s.f)
 
+class MemoryFile(object):
+    """ read-only file object over a buffer that reads without copying it """
+    def __init__(self, buf):
+        self.buf = memoryview(buf).cast("B").toreadonly()
+        self.pos = 0
+
+    def tell(self):
+        return self.pos
+
+    def seek(self, at, where=os.SEEK_SET):
+        if where == os.SEEK_CUR:
+            at += self.pos
+        elif where == os.SEEK_END:
+            at += len(self.buf)
+        self.pos = at
+        return at
+
+    def read(self, size=-1):
+        end = len(self.buf) if size < 0 else self.pos + size
+        d = self.buf[self.pos:end].tobytes()
+        self.pos += len(d)
+        return d
+
+    def readinto(self, inbuf):
+        src = self.buf[self.pos:self.pos + len(inbuf)]
+        n = len(src)
+        memoryview(inbuf).cast("B")[:n] = src
+        self.pos += n
+        return n
+
 class R(object):
-    """ file reader based on types """
+    """ file reader based on types. file can also be a bytes-like object """
     def __init__(self, file, *, encoding="utf-8"):
+        if isinstance(file, (bytes, bytearray, memoryview)):
+            file = MemoryFile(file)
         self.f = file
         self.encoding = encoding
 
+    @property
+    def in_memory(self):
+        return isinstance(self.f, MemoryFile)
+
     int8_t    = latebinder(readfunc(">b"))
     uint8_t   = latebinder(readfunc(">B"))
     int16_t   = latebinder(readfunc(">h"))
@@ -122,21 +158,35 @@ class R(object):
 
         return self.f.read(size)
 
+    def view(self, size, at):
+        """ like bytes(), but returns a read-only memoryview without copying if
+            the reader was given a bytes-like object. file objects (including
+            BytesIO, which a view would lock against writes and close()) are
+            read into bytes as usual """
+        if self.in_memory:
+            return self.f.buf[at:at + size]
+
+        return self.bytes(size, at=at)
+
     def bytesinto(self, inbuf, at=None):
         if at is not None:
             back = self.f.tell()
             self.f.seek(at)
-            self.bytesinto(inbuf)
+            n = self.bytesinto(inbuf)
             self.f.seek(back)
-            return
+            return n
 
-        self.f.readinto(inbuf)
+        return self.f.readinto(inbuf)
 
     def string0(self, at=None):
+        return self.bytes0(at=at).decode(self.encoding)
+
+    def bytes0(self, at=None):
+        """ a NUL-terminated string, without decoding it """
         if at is not None:
             back = self.f.tell()
             self.f.seek(at)
-            d = self.string0()
+            d = self.bytes0()
             self.f.seek(back)
             return d
 
@@ -160,7 +210,7 @@ class R(object):
             break
         string = JOIN_BYTE_ARRAY(sr)
         self.f.seek(bk + len(string) + 1)
-        return string.decode(self.encoding)
+        return string
 
 class Struct(struct.Struct):
     """ struct with an output filter (usually a namedtuple) """
@@ -197,7 +247,7 @@ def promise_data(r):
 
 def promise_string(r):
     offset = r.uint32_t()
-    return lambda h: r.string0(at=h.string_table_offset + 8 + offset)
+    return lambda h: r.bytes0(at=h.string_table_offset + 8 + offset)
 
 column_data_dtable = {
     COLUMN_TYPE_DATA   : promise_data,
@@ -228,28 +278,37 @@ utf_header_t = Struct(">IHHIIIHHI",
     "data_offset", "table_name_offset", "number_of_fields", "row_size", "number_of_rows")))
 
 class UTFTable(object):
+    """ A parsed UTF table. Strings are kept undecoded alongside the decoded rows,
+        so decode() can switch encodings without reading the file again. If
+        encoding is None, nothing is decoded until decode() is called. """
     def __init__(self, file, *, encoding="sjis"):
-        buf = R(file, encoding=encoding)
+        buf = R(file, encoding=encoding or "utf-8")
         magic = buf.uint32_t()
         if magic != 0x40555446:
             raise ValueError("bad magic")
 
         self.header = buf.struct(utf_header_t)
-        self.name = buf.string0(at=self.header.string_table_offset + 8 + self.header.table_name_offset)
-        self.encoding = encoding
+        self.raw_name = buf.bytes0(at=self.header.string_table_offset + 8 + self.header.table_name_offset)
+        self.name = None
+        self.encoding = None
+        self.rows = None
 
         buf.seek(0x20)
         self.read_schema(buf)
 
         buf.seek(self.header.row_offset + 8)
-        self.rows = list(self.iter_rows(buf))
+        self.raw_rows = list(self.iter_raw_rows(buf))
+
+        if encoding is not None:
+            self.decode(encoding)
 
     def read_schema(self, buf):
         buf.seek(0x20)
 
-        dynamic_keys = []
+        raw_keys = []
+        string_columns = []
         format = ">"
-        constants = {}
+        raw_constants = []
 
         for _ in range(self.header.number_of_fields):
             field_type = buf.uint8_t()
@@ -257,22 +316,24 @@ class UTFTable(object):
 
             occurrence = field_type & COLUMN_STORAGE_MASK
             type_key = field_type & COLUMN_TYPE_MASK
+            name = buf.bytes0(at=self.header.string_table_offset + 8 + name_offset)
 
             if occurrence in (COLUMN_STORAGE_CONSTANT, COLUMN_STORAGE_CONSTANT2):
-                name = buf.string0(at=self.header.string_table_offset + 8 + name_offset)
                 val = column_data_dtable[type_key](buf)
-                constants[name] = val
+                raw_constants.append((name, val, type_key == COLUMN_TYPE_STRING))
             else:
-                dynamic_keys.append(buf.string0(at=self.header.string_table_offset + 8 + name_offset))
+                if type_key == COLUMN_TYPE_STRING:
+                    string_columns.append(len(raw_keys))
+                raw_keys.append(name)
                 format += column_data_stable[type_key]
 
-        for k in constants.keys():
-            if callable(constants[k]):
-                constants[k] = constants[k](self.header)
+        raw_constants = [(k, v(self.header) if callable(v) else v, is_string)
+            for k, v, is_string in raw_constants]
 
-        self.dynamic_keys = dynamic_keys
+        self.raw_keys = raw_keys
+        self.string_columns = string_columns
         self.struct_format = format
-        self.constants = constants
+        self.raw_constants = raw_constants
 
     def resolve(self, buf, *args):
         ret = []
@@ -283,18 +344,39 @@ class UTFTable(object):
                     ret.append(buf.bytes(size, at=self.header.data_offset + 8 + offset))
                 else:
                     offset = struct.unpack(">I", val)[0]
-                    ret.append(buf.string0(at=self.header.string_table_offset + 8 + offset))
+                    ret.append(buf.bytes0(at=self.header.string_table_offset + 8 + offset))
             else:
                 ret.append(val)
         return tuple(ret)
 
-    def iter_rows(self, buf):
+    def iter_raw_rows(self, buf):
         sfmt = Struct(self.struct_format, functools.partial(self.resolve, buf))
         for n in range(self.header.number_of_rows):
-            values = buf.struct(sfmt)
-            ret = {k: v for k, v in zip(self.dynamic_keys, values)}
-            ret.update(self.constants)
-            yield ret
+            yield buf.struct(sfmt)
+
+    def decode(self, encoding):
+        """ (re)build name, dynamic_keys, constants and rows with strings decoded
+            using encoding. Raises UnicodeDecodeError and leaves the table as it
+            was if any string can't be decoded. """
+        name = self.raw_name.decode(encoding)
+        dynamic_keys = [k.decode(encoding) for k in self.raw_keys]
+        constants = {k.decode(encoding): v.decode(encoding) if is_string else v
+            for k, v, is_string in self.raw_constants}
+
+        rows = []
+        for raw in self.raw_rows:
+            values = list(raw)
+            for i in self.string_columns:
+                values[i] = values[i].decode(encoding)
+            ret = dict(zip(dynamic_keys, values))
+            ret.update(constants)
+            rows.append(ret)
+
+        self.name = name
+        self.dynamic_keys = dynamic_keys
+        self.constants = constants
+        self.rows = rows
+        self.encoding = encoding
 
     def __repr__(self):
-        return "<UTFTable '{1}' with {0} rows >".format(len(self.rows), self.name)
+        return "<UTFTable '{1}' with {0} rows >".format(len(self.raw_rows), self.name)
@@ -0,0 +1,197 @@
+import io
+import os
+import struct
+
+import pytest
+
+from acb import ACBFile, AFSArchive, extract_acb, name_gen_default, track_t
+from acb.acb import _output_jobs
+
+def make_afs2(files, alignment=32):
+    """ build an AFS2 archive (4-byte offsets, 2-byte cue IDs) from (cue_id, data) pairs """
+    header = b"AFS2" + bytes([2, 4, 2, 0]) + struct.pack("<IHH", len(files), alignment, 0)
+    header += struct.pack("<%dH" % len(files), *(cue_id for cue_id, _ in files))
+    pos = len(header) + 4 * (len(files) + 1)
+
+    offsets = []
+    body = bytearray()
+    for _, data in files:
+        offsets.append(pos)
+        start = (pos + alignment - 1) & ~(alignment - 1)
+        body += bytes(start - pos) + data
+        pos = start + len(data)
+    offsets.append(pos)
+
+    return header + struct.pack("<%dI" % len(offsets), *offsets) + bytes(body)
+
+FILES = [(i * 3 + 1, bytes([i + 1]) * (i * 37 + 5)) for i in range(8)]
+
+def test_copy_file_to():
+    raw = make_afs2(FILES)
+    # a file object is copied in chunks; bytes are written straight from memory
+    for src in (io.BytesIO(raw), raw):
+        archive = AFSArchive(src)
+        for cue_id, data in FILES:
+            out = io.BytesIO()
+            archive.copy_file_to(cue_id, out, chunk=16)
+            assert out.getvalue() == data
+            assert bytes(archive.file_data_for_cue_id(cue_id, rw=True)) == data
+
+def test_copy_file_to_truncated():
+    # the last file loses its final 100 bytes; both paths pad them with zeros
+    raw = make_afs2(FILES)[:-100]
+    cue_id, data = FILES[-1]
+    expect = data[:-100] + bytes(100)
+    for src in (io.BytesIO(raw), raw):
+        archive = AFSArchive(src)
+        out = io.BytesIO()
+        archive.copy_file_to(cue_id, out, chunk=16)
+        assert out.getvalue() == expect
+        assert bytes(archive.file_data_for_cue_id(cue_id, rw=True)) == expect
+        assert bytes(archive.file_data_for_cue_id(cue_id, out=bytearray(b"x" * 1000))) == expect
+
+def test_name_gen_default():
+    assert name_gen_default(track_t(1, "bgm", 2, 0)) == "bgm.hca"
+    assert name_gen_default(track_t(1, "bgm", 5, 0)) == "bgm5"
+    # values outside the 1-byte EncodeType column still fall back to the number
+    assert name_gen_default(track_t(1, "bgm", 300, 0)) == "bgm300"
+    assert name_gen_default(track_t(1, "bgm", -1, 0)) == "bgm-1"
+
+def make_utf(name, columns, rows):
+    """ build a UTF table from (name, type) columns, where type is a struct code,
+        "s" for a string or "d" for data, and rows of values. strings are utf-8 """
+    strings = bytearray(b"<NULL>\x00")
+    data = bytearray()
+
+    def add_string(s):
+        offset = len(strings)
+        strings.extend(s.encode("utf-8") + b"\x00")
+        return offset
+
+    type_codes = {"B": 0x00, "H": 0x02, "I": 0x04, "s": 0x0A, "d": 0x0B}
+    name_offset = add_string(name)
+    schema = bytearray()
+    fmt = ">"
+    for col_name, col_type in columns:
+        schema += struct.pack(">BI", 0x50 | type_codes[col_type], add_string(col_name))
+        fmt += {"s": "I", "d": "II"}.get(col_type, col_type)
+
+    row_data = bytearray()
+    for row in rows:
+        values = []
+        for (_, col_type), value in zip(columns, row):
+            if col_type == "s":
+                values.append(add_string(value))
+            elif col_type == "d":
+                values += [len(data), len(value)]
+                data.extend(value)
+            else:
+                values.append(value)
+        row_data += struct.pack(fmt, *values)
+
+    row_offset = 0x18 + len(schema)
+    string_offset = row_offset + len(row_data)
+    data_offset = string_offset + len(strings)
+    body = schema + row_data + strings + data
+    header = struct.pack(">IHHIIIHHI", 0x18 + len(body), 1, row_offset, string_offset,
+        data_offset, name_offset, len(columns), struct.calcsize(fmt), len(rows))
+    return b"@UTF" + header + body
+
+def make_acb(cue_names, awb_files, enc_type=2, wav_for_cue=None):
+    """ build an ACB with one single-waveform cue per name, backed by the given
+        (cue_id, data) files in an embedded AWB. wav_for_cue lists the index of
+        the file each cue plays (default: cue i plays file i) """
+    if wav_for_cue is None:
+        wav_for_cue = range(len(cue_names))
+    cues = make_utf("Cue", [("ReferenceType", "B"), ("ReferenceIndex", "H"), ("NumRelatedWaveforms", "H")],
+        [(3, i, 1) for i in range(len(cue_names))])
+    names = make_utf("CueName", [("CueIndex", "H"), ("CueName", "s")], list(enumerate(cue_names)))
+    wavs = make_utf("Waveform", [("MemoryAwbId", "H"), ("StreamAwbId", "H"), ("EncodeType", "B"), ("Streaming", "B")],
+        [(cue_id, 0, enc_type, 0) for cue_id, _ in awb_files])
+    synths = make_utf("Synth", [("ReferenceItems", "d")],
+        [(struct.pack(">HH", 1, i),) for i in wav_for_cue])
+    return make_utf("Header", [("CueTable", "d"), ("CueNameTable", "d"), ("WaveformTable", "d"),
+        ("SynthTable", "d"), ("AwbFile", "d")], [(cues, names, wavs, synths, make_afs2(awb_files))])
+
+def test_encoding_fallback():
+    # "テスト" in utf-8 isn't valid Shift-JIS, so the default decoding has to fall back
+    acb_data = make_acb(["テスト", "bgm"], FILES[:2])
+
+    with ACBFile(io.BytesIO(acb_data)) as acb:
+        assert acb.encoding == "utf-8"
+        assert [t.name for t in acb.track_list] == ["テスト", "bgm"]
+        assert bytes(acb.get_track_data(acb.track_list[1])) == FILES[1][1]
+
+    with ACBFile(io.BytesIO(acb_data), encoding="utf-8") as acb:
+        assert acb.encoding == "utf-8"
+
+    with pytest.raises(UnicodeDecodeError):
+        ACBFile(io.BytesIO(acb_data), encoding="sjis")
+
+def test_track_list():
+    with ACBFile(io.BytesIO(make_acb(["a", "b", "c"], FILES[:3]))) as acb:
+        track_list = acb.track_list
+        assert len(track_list) == 3
+        assert track_list[2] == track_t(FILES[2][0], "c", 2, 0)
+        assert track_list[-1] == track_list[2]
+        assert track_list[1:] == [track_list[1], track_list[2]]
+        assert track_list[::2] == [track_list[0], track_list[2]]
+        assert list(track_list) == track_list.tracks
+        # .tracks is a plain list that is built once
+        assert track_list.tracks is track_list.tracks
+        track_list.tracks.append(track_list[0])
+        assert len(track_list.tracks) == 4
+
+def test_extract_shared_and_duplicate_names(tmp_path):
+    # cues 0, 2 and 4 share file 0; cues 1 and 3 both become "dup.hca"
+    acb_data = make_acb(["a", "dup", "c", "dup", "e"], FILES[:4], wav_for_cue=[0, 1, 0, 3, 0])
+    extract_acb(io.BytesIO(acb_data), str(tmp_path), max_workers=4)
+
+    assert sorted(os.listdir(tmp_path)) == ["a.hca", "c.hca", "dup.hca", "e.hca"]
+    for name in ("a.hca", "c.hca", "e.hca"):
+        assert (tmp_path / name).read_bytes() == FILES[0][1]
+    # the last track to use a name wins
+    assert (tmp_path / "dup.hca").read_bytes() == FILES[3][1]
+
+def test_output_jobs():
+    names = ["BGM.hca", "se.hca", "bgm.hca", "a.hca", "se.hca", "b.hca"]
+    wav_keys = [(0, 1), (0, 2), (0, 3), (0, 4), (0, 5), (0, 1)]
+    jobs = _output_jobs("out", names, wav_keys)
+    # case variants and shared waveforms share a job, written in track order;
+    # the first se.hca is dropped as the second one replaces it
+    assert sorted(jobs) == [[0, 2, 5], [3], [4]]
+
+def test_extract_case_variants(tmp_path):
+    (tmp_path / "X").touch()
+    case_insensitive = (tmp_path / "x").exists()
+    (tmp_path / "X").unlink()
+
+    acb_data = make_acb(["BGM", "bgm", "Bgm", "se", "SE"], FILES[:4], wav_for_cue=[0, 1, 0, 2, 2])
+    extract_acb(io.BytesIO(acb_data), str(tmp_path), max_workers=4)
+
+    if case_insensitive:
+        # the last write to each file wins, whichever spelling it was made with
+        assert len(os.listdir(tmp_path)) == 2
+        assert (tmp_path / "bgm.hca").read_bytes() == FILES[0][1]
+        assert (tmp_path / "se.hca").read_bytes() == FILES[2][1]
+    else:
+        assert sorted(os.listdir(tmp_path)) == ["BGM.hca", "Bgm.hca", "SE.hca", "bgm.hca", "se.hca"]
+        assert (tmp_path / "BGM.hca").read_bytes() == FILES[0][1]
+        assert (tmp_path / "bgm.hca").read_bytes() == FILES[1][1]
+        assert (tmp_path / "Bgm.hca").read_bytes() == FILES[0][1]
+        assert (tmp_path / "SE.hca").read_bytes() == FILES[2][1]
+
+def test_file_data_for_cue_id_read_only():
+    raw = make_afs2(FILES)
+    cue_id, data = FILES[1]
+
+    # a file object is read into bytes and isn't locked by the result
+    stream = io.BytesIO(raw)
+    result = AFSArchive(stream).file_data_for_cue_id(cue_id)
+    assert isinstance(result, bytes) and result == data
+    stream.close()
+
+    # a bytes-like archive returns a read-only view into it
+    result = AFSArchive(raw).file_data_for_cue_id(cue_id)
+    assert isinstance(result, memoryview) and result.readonly
+    assert bytes(result) == data
@@ -114,3 +114,39 @@ def test_full_disarm():
     context.disarm(vec4)
     hash = hashlib.sha256(vec4).hexdigest()
     assert hash == "ac080f61f6608d899c39ef09742cf7b5665ecb5ff616c2b421957bf1cd476869"
+
+def test_disarm_memoryview():
+    # Disarming a view into a larger scratch buffer should match disarming a bytearray.
+    vec4 = binascii.unhexlify(TVEC4)
+    scratch = bytearray(len(vec4) + 64)
+    view = memoryview(scratch)[:len(vec4)]
+    view[:] = vec4
+    disarm._acb_speedup = _acb_speedup
+    context = disarm.DisarmContext("0x0")
+    context.disarm(view)
+    hash = hashlib.sha256(view).hexdigest()
+    assert hash == "ac080f61f6608d899c39ef09742cf7b5665ecb5ff616c2b421957bf1cd476869"
+
+    view[:] = vec4
+    disarm._acb_speedup = None
+    context = disarm.DisarmContext("0x0")
+    context.disarm(view)
+    hash = hashlib.sha256(view).hexdigest()
+    assert hash == "ac080f61f6608d899c39ef09742cf7b5665ecb5ff616c2b421957bf1cd476869"
+
+def test_disarm_blocks_multiple():
+    # Make sure both versions agree when more than one block is decrypted at once.
+    blocks = bytes((i * 7 + 3) & 0xff for i in range(0x10 + 0xCC * 4))
+    context = disarm.DisarmContext("0x0123456789abcdef")
+
+    vec_c = bytearray(blocks)
+    disarm._acb_speedup = _acb_speedup
+    context.disarm_blocks(vec_c, 0x10, 4, 0xCC, 56)
+
+    vec_py = bytearray(blocks)
+    disarm._acb_speedup = None
+    context.disarm_blocks(vec_py, 0x10, 4, 0xCC, 56)
+
+    assert vec_c == vec_py
+    assert vec_c[:0x10] == blocks[:0x10]
+    assert vec_c != bytearray(blocks)